@@ -1,10 +1,74 @@
 import pandas as pd
-import math
+import numpy as np
+import bisect
 from datetime import datetime
+from typing import NamedTuple
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # numba が無い環境でもそのまま動くよう、何もしないデコレータで代用する
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 # ==========================================
 # 1. テクニカル指標の計算
 # ==========================================
+@njit(cache=True, nogil=True)
+def _compute_indicators(close, volume):
+    """
+    MA5/MA25/MA75/RSI/出来高MA5 を1回の走査でまとめて計算する
+    各ウィンドウの合計値は「新しい値を足して古い値を引く」で更新する
+    RSIは TradingView 等と同じ Wilder の平滑化（初期値は最初の14日分の単純平均）を用いる
+    """
+    n = len(close)
+    ma5 = np.full(n, np.nan)
+    ma25 = np.full(n, np.nan)
+    ma75 = np.full(n, np.nan)
+    rsi = np.full(n, np.nan)
+    volma5 = np.full(n, np.nan)
+
+    sum5 = sum25 = sum75 = vol5 = avg_gain = avg_loss = 0.0
+    for i in range(n):
+        c = close[i]
+        sum5 += c
+        sum25 += c
+        sum75 += c
+        vol5 += volume[i]
+        if i >= 5:
+            sum5 -= close[i - 5]
+            vol5 -= volume[i - 5]
+        if i >= 25: sum25 -= close[i - 25]
+        if i >= 75: sum75 -= close[i - 75]
+
+        if i >= 4:
+            ma5[i] = sum5 / 5
+            volma5[i] = vol5 / 5
+        if i >= 24: ma25[i] = sum25 / 25
+        if i >= 74: ma75[i] = sum75 / 75
+
+        # RSI計算（Wilder の平滑化。最初の14日分の差分の単純平均を初期値とする）
+        if i == 0: continue
+        delta = c - close[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        if i <= 14:
+            avg_gain += gain
+            avg_loss += loss
+            if i < 14: continue
+            avg_gain /= 14
+            avg_loss /= 14
+        else:
+            avg_gain = (avg_gain * 13 + gain) / 14
+            avg_loss = (avg_loss * 13 + loss) / 14
+        rsi[i] = 100 - (100 / (1 + (avg_gain / (avg_loss + 1e-10))))
+
+    return ma5, ma25, ma75, rsi, volma5
+
 def add_technical_indicators(df):
     """
     データフレームにテクニカル指標（MA, RSI, 出来高MA）を追加する
@@ -12,59 +76,117 @@ def add_technical_indicators(df):
     """
     if df is None or df.empty:
         return None
-    
+
+    # 累積和の誤差を避けるため計算は float64 で行い、結果は元のデータ型に揃える
+    dtype = df['Close'].dtype
+    close = df['Close'].to_numpy(dtype=np.float64)
+    volume = df['Volume'].to_numpy(dtype=np.float64)
+    ma5, ma25, ma75, rsi, volma5 = _compute_indicators(close, volume)
+
     # 移動平均線
-    df['MA5'] = df['Close'].rolling(window=5).mean()
-    df['MA25'] = df['Close'].rolling(window=25).mean()
-    df['MA75'] = df['Close'].rolling(window=75).mean() # 長期用に追加
-    
-    # RSI計算
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    df['RSI'] = 100 - (100 / (1 + (gain / (loss + 1e-10))))
-    
+    df['MA5'] = ma5.astype(dtype, copy=False)
+    df['MA25'] = ma25.astype(dtype, copy=False)
+    df['MA75'] = ma75.astype(dtype, copy=False) # 長期用に追加
+
+    # RSI
+    df['RSI'] = rsi.astype(dtype, copy=False)
+
     # 出来高移動平均
-    df['VolMA5'] = df['Volume'].rolling(window=5).mean()
-    
+    df['VolMA5'] = volma5.astype(dtype, copy=False)
+
+    return add_period_high(df)
+
+def add_period_high(df):
+    """
+    各日以降の最高値（PeriodHigh）列を追加する
+    購入日以降の高値を O(1) で引けるよう事前計算しておく
+    """
+    high = df['High'].to_numpy()
+    df['PeriodHigh'] = np.maximum.accumulate(high[::-1])[::-1]
     return df
 
-def get_latest_metrics(df, purchase_price, purchase_timestamp_str=None):
+class LatestValues(NamedTuple):
+    """1銘柄分の直近の指標値（_prev は前日分）"""
+    close: float
+    high: float
+    rsi: float
+    ma5: float
+    ma25: float
+    ma75: float
+    ma5_prev: float
+    ma25_prev: float
+    vol: float
+    vol_ma5: float
+
+def get_latest_values(df):
+    """
+    描画ループで使う直近の指標値を LatestValues にまとめて返す
+    指標は列として保持せず、計算結果の末尾（と前日分）だけを取り出す
+    """
+    close = df['Close'].to_numpy(dtype=np.float64)
+    volume = df['Volume'].to_numpy(dtype=np.float64)
+    ma5, ma25, ma75, rsi, volma5 = _compute_indicators(close, volume)
+    has_prev = len(close) >= 2
+    return LatestValues(
+        close=float(close[-1]), high=float(df['High'].max()), rsi=float(rsi[-1]),
+        ma5=float(ma5[-1]), ma25=float(ma25[-1]), ma75=float(ma75[-1]),
+        ma5_prev=float(ma5[-2]) if has_prev else np.nan,
+        ma25_prev=float(ma25[-2]) if has_prev else np.nan,
+        vol=float(volume[-1]), vol_ma5=float(volma5[-1]),
+    )
+
+def get_latest_metrics(df, purchase_price, purchase_timestamp_str=None, values=None):
     """
     購入日以降のデータに基づいて指標を取得する（Exit判定用）
+    Args:
+        values (LatestValues): get_latest_values() の結果（計算済みなら渡して再計算を省く）
     """
     if df is None or df.empty:
         return 0, 0, 0, 0
 
-    current_price = df['Close'].iloc[-1]
-    ma75 = df['MA75'].iloc[-1] if 'MA75' in df.columns else 0 # MA75取得
+    if values is None:
+        values = get_latest_values(df)
+    current_price = values.close
+    ma75 = values.ma75 # MA75取得
     
-    # 期間フィルタリング（購入日以降のみ対象）
-    target_df = df
+    # 最高値の決定（購入日以降のみ対象、購入単価を下限とする）
+    if 'PeriodHigh' not in df.columns:
+        add_period_high(df)
+    period_high = df['PeriodHigh'].iloc[0]
     if purchase_timestamp_str:
         try:
-            buy_date = datetime.fromtimestamp(float(purchase_timestamp_str)).date()
-            mask = [d.date() >= buy_date for d in df.index]
-            filtered_df = df[mask]
-            target_df = filtered_df if not filtered_df.empty else df.tail(1)
-        except:
-            pass
-
-    # 最高値の決定（購入単価を下限とする）
-    period_high = target_df['High'].max()
-    
+            buy_date = datetime.fromtimestamp(float(purchase_timestamp_str))
+        except (ValueError, TypeError, OverflowError, OSError):
+            buy_date = None
+        if buy_date is not None:
+            # 購入日の0時と比較（インデックスのタイムゾーンに合わせる）
+            buy_ts = pd.Timestamp(buy_date.date())
+            if df.index.tz is not None:
+                buy_ts = buy_ts.tz_localize(df.index.tz)
+            # 購入日以降のデータが無い場合は直近の高値を使う
+            i = df.index.searchsorted(buy_ts)
+            period_high = df['PeriodHigh'].iloc[min(i, len(df) - 1)]
+
     if pd.isna(period_high):
         recent_high = max(purchase_price, current_price)
     else:
         recent_high = max(purchase_price, period_high)
 
-    rsi = df['RSI'].iloc[-1] if 'RSI' in df.columns else 0
+    rsi = values.rsi
     
     return current_price, recent_high, rsi, ma75
 
 # ==========================================
 # 2. 売買判定ロジック
 # ==========================================
+# 長期モードのゾーン定義（含み益%の境界とゾーンごとのトレール率・ラベル）
+#   Zone 1: 含み益10%未満 -> 「短期モード」と同じ厳戒態勢（トレールは設定値そのまま）
+#   Zone 2: 含み益10-30% -> トレールを15%に広げて様子見
+#   Zone 3: 含み益30%超 -> トレール20% ＆ MA75サポート
+_LONG_THRESHOLDS = (10.0, 30.0)
+_LONG_TRAILS = (None, 0.15, 0.20)
+_LONG_LABELS = ("長期：育成中", "長期：安定期(トレール15%)", "長期：収穫期(MA75/20%)")
+
 def calculate_exit_strategy(price_buy, price_curr, price_high, ma75, stop_pct, trail_pct, mode="short"):
     """
     【Exit判定】利確・損切りのロジック
@@ -76,24 +198,13 @@ def calculate_exit_strategy(price_buy, price_curr, price_high, ma75, stop_pct, t
     used_trail_pct = trail_pct # デフォルトは設定値を使用
     
     # --- モード分岐 ---
+    zone = 0
     if mode == "long":
         # 【長期モード (案2: 利益バッファ活用)】
         # 利益の乗り具合でリスク許容度を自動調整
-        
-        if profit_pct < 10.0:
-            # Zone 1: 含み益10%未満 -> 「短期モード」と同じ厳戒態勢
-            label = "長期：育成中"
-            used_trail_pct = trail_pct # 設定値(例:10%)そのまま
-            
-        elif 10.0 <= profit_pct < 30.0:
-            # Zone 2: 含み益10-30% -> トレールを15%に広げて様子見
-            label = "長期：安定期(トレール15%)"
-            used_trail_pct = 0.15 
-            
-        else:
-            # Zone 3: 含み益30%超 -> トレール20% ＆ MA75サポート
-            label = "長期：収穫期(MA75/20%)"
-            used_trail_pct = 0.20
+        zone = bisect.bisect_right(_LONG_THRESHOLDS, profit_pct)
+        label = _LONG_LABELS[zone]
+        used_trail_pct = _LONG_TRAILS[zone] or trail_pct
     else:
         # 【短期モード】
         # 常にユーザー設定のトレール率を使用
@@ -113,9 +224,7 @@ def calculate_exit_strategy(price_buy, price_curr, price_high, ma75, stop_pct, t
     trail_line = price_high * (1 - used_trail_pct)
     
     # 3. テクニカル指標ライン（長期モードのZone3のみ MA75 を考慮）
-    ma_line = 0
-    if mode == "long" and profit_pct >= 30.0:
-        ma_line = ma75
+    ma_line = ma75 if zone == 2 else 0
     
     # すべてのラインの中で「最も高い価格」を逆指値とする
     suggested_price = max(base_line, trail_line, ma_line)
@@ -137,38 +246,48 @@ def calculate_exit_strategy(price_buy, price_curr, price_high, ma75, stop_pct, t
         "profit_pct": profit_pct
     }
 
-def analyze_entry_strategy(df):
+# Entry判定の理由（score_entry_strategies の判定順と対応）
+_ENTRY_REASONS = ("RSI低値圏", "ゴールデンクロス", "出来高急増")
+
+def analyze_entry_strategy(df, values=None):
     """
     【Entry判定】スコアリング (変更なし)
+    Args:
+        values (LatestValues): get_latest_values() の結果（計算済みなら渡して再計算を省く）
     """
     if df is None or df.empty:
         return 0, []
 
-    rsi = df['RSI'].iloc[-1]
-    ma5 = df['MA5'].iloc[-1]
-    ma25 = df['MA25'].iloc[-1]
-    vol_curr = df['Volume'].iloc[-1]
-    vol_ma5 = df['VolMA5'].iloc[-1]
-    
-    score = 0
-    reasons = []
+    if values is None:
+        values = get_latest_values(df)
+    scores, reasons = score_entry_strategies([values])
+    return scores[0], reasons[0]
 
-    if rsi < 35:
-        score += 50
-        reasons.append("RSI低値圏")
-
-    if len(df) >= 2:
-        prev_ma5 = df['MA5'].iloc[-2]
-        prev_ma25 = df['MA25'].iloc[-2]
-        if ma5 > ma25 and prev_ma5 <= prev_ma25:
-            score += 50
-            reasons.append("ゴールデンクロス")
+def score_entry_strategies(values_list):
+    """
+    【Entry判定】複数銘柄のスコアを NumPy の配列演算でまとめて計算する
+    Args:
+        values_list (list[LatestValues]): 銘柄ごとの get_latest_values() の結果
+    Returns:
+        (list[int], list[list[str]]): 銘柄ごとのスコアと理由
+    """
+    # 銘柄 x 指標 の2次元配列にして、指標ごとの列を取り出す
+    table = np.array(values_list, dtype=np.float64).reshape(-1, len(LatestValues._fields))
+    cols = dict(zip(LatestValues._fields, table.T))
 
-    if vol_ma5 > 0 and vol_curr > (vol_ma5 * 1.5):
-        score += 20
-        reasons.append("出来高急増")
+    # RSI低値圏: +50
+    rsi_low = cols['rsi'] < 35
+    # ゴールデンクロス: +50（前日分が無い場合は NaN となり、比較は常に偽になる）
+    golden_cross = (cols['ma5'] > cols['ma25']) & (cols['ma5_prev'] <= cols['ma25_prev'])
+    # 出来高急増: +20
+    vol_surge = (cols['vol_ma5'] > 0) & (cols['vol'] > cols['vol_ma5'] * 1.5)
 
-    return score, reasons
+    scores = rsi_low * 50 + golden_cross * 50 + vol_surge * 20
+    reasons = [
+        [label for label, hit in zip(_ENTRY_REASONS, hits) if hit]
+        for hits in zip(rsi_low, golden_cross, vol_surge)
+    ]
+    return scores.tolist(), reasons
 
 # ==========================================
 # 3. 資金管理ロジック
@@ -177,18 +296,13 @@ def calculate_position_size(total_capital, risk_pct, price_curr, stop_pct):
     """
     【資金管理】リスクリワードに基づく推奨株数を計算する (変更なし)
     """
-    if price_curr <= 0: return 0
+    # 損切り幅が0以下なら許容リスクから株数を決められないため0株とする
+    if price_curr <= 0 or stop_pct <= 0: return 0
 
     risk_limit = total_capital * (risk_pct / 100)
-    dist = price_curr * stop_pct 
-    
-    if dist <= 0:
-        risk_based_shares = 0
-    else:
-        risk_based_shares = risk_limit / dist
-    
+    risk_based_shares = risk_limit / (price_curr * stop_pct)
     budget_based_shares = total_capital / price_curr
     final_raw_shares = min(risk_based_shares, budget_based_shares)
-    rec_shares = math.floor(final_raw_shares / 100) * 100
+    rec_shares = int(final_raw_shares) // 100 * 100
     
     return rec_shares
\ No newline at end of file
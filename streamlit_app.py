@@ -4,22 +4,45 @@ import pandas as pd
 import json
 import base64
 import os
+import time
+import uuid
+import threading
 from datetime import datetime
-from github import Github
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.logger import get_logger
+from yfinance.exceptions import YFException
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ロジックファイルをインポート
 import logic 
 
+logger = get_logger(__name__)
+
+# yfinance 取得時に想定される例外（通信エラーは requests/curl_cffi とも OSError の派生）
+YF_ERRORS = (YFException, OSError, KeyError, AttributeError, ValueError)
+
 # ==========================================
 # 0. 基本設定
 # ==========================================
 st.set_page_config(page_title="Trend Checker Pro v6.1", layout="wide")
 
+@st.cache_data(show_spinner=False)
+def _load_css_text(file_name, mtime):
+    """<style> タグ込みのCSS文字列を作る（mtime をキーに含め、ファイル更新時だけ読み直す）"""
+    with open(file_name, encoding="utf-8") as f:
+        return f'<style>{f.read()}</style>'
+
 def load_css(file_name):
     """CSSファイルを読み込んで適用する"""
     if os.path.exists(file_name):
-        with open(file_name) as f:
-            st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        st.markdown(_load_css_text(file_name, os.path.getmtime(file_name)), unsafe_allow_html=True)
 
 # ==========================================
 # 1. 認証 & GitHub同期
@@ -47,72 +70,487 @@ def check_password():
         st.markdown('</div>', unsafe_allow_html=True)
     return False
 
-def sync_github(data=None, action="load"):
-    GITHUB_TOKEN = st.secrets["GITHUB_TOKEN"]
-    REPO_NAME = f"{st.secrets['GITHUB_USERNAME']}/{st.secrets['GITHUB_REPO_NAME']}"
-    FILE_PATH = st.secrets["DATA_FILE_PATH"]
-    
+def index_portfolio(stocks, stamp_new=False):
+    """
+    銘柄リストを id をキーにした辞書に変換する（画面上の追加・削除を O(1) で行うため）
+    id が無い・重複している行には新しい id を振る
+    stamp_new=True の場合、id の無い行はエディタで追加された新規行として現在時刻を登録日時にする
+    """
+    by_id = {}
+    for p in stocks:
+        sid = p.get("id")
+        # 登録日時が無い行は旧形式の id（タイムスタンプ）で補う（id を振り直す前に行う）
+        # 補えない旧データは登録日時なしのまま残し、全期間の高値で判定する
+        if not p.get("created_at"):
+            created_at = _id_timestamp(sid)
+            if created_at is None and stamp_new and not sid:
+                created_at = str(time.time())
+            if created_at is not None:
+                p["created_at"] = created_at
+        if not sid or sid in by_id:
+            sid = p["id"] = uuid.uuid4().hex
+        by_id[sid] = p
+    return by_id
+
+def _id_timestamp(sid):
+    """旧形式（登録時のタイムスタンプ）の id ならその文字列を、そうでなければ None を返す"""
     try:
-        g = Github(GITHUB_TOKEN)
-        repo = g.get_repo(REPO_NAME)
+        datetime.fromtimestamp(float(sid))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    return sid
+
+def rows_changed(rows, portfolio):
+    """エディタの行が元の銘柄データから変わっているか（欠けているキーは None とみなす）"""
+    if len(rows) != len(portfolio): return True
+    return any(
+        any(r.get(k) != p.get(k) for k in r.keys() | p.keys())
+        for r, p in zip(rows, portfolio.values())
+    )
+
+def portfolio_payload(data):
+    """保存用に portfolio を元のリスト形式へ戻したデータを返す"""
+    return {**data, "portfolio": list(data["portfolio"].values())}
+
+def dump_json(data):
+    """ポートフォリオをJSON文字列に変換する（orjson があれば高速な方を使う）"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+def load_json(raw):
+    """
+    JSON（bytes/str）をパースする（orjson があれば高速な方を使う）
+    以前の json.dumps で保存したファイルは空のセルが NaN と書かれており orjson では読めないため、
+    その場合は標準の json で読み直す
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+GITHUB_TIMEOUT = 10 # GitHub API のタイムアウト（秒）
+RETRY_AFTER_MAX = 30 # 保存時に Retry-After で待つ上限（秒）
+
+class _CappedRetry(Retry):
+    """Retry-After の待ち時間に上限を設けた再試行ポリシー"""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+@st.cache_resource
+def _gh_session(background=False):
+    """
+    GitHub REST API 用のセッションを使い回す
+    （1ファイルの読み書きだけなので PyGithub は使わず、keep-alive の接続で直接叩く）
+    レート制限(429)や一時的なサーバーエラーは再試行する
+      background=False: 画面描画を止める読み込み用。1回だけすぐに再試行し、Retry-After は待たない
+      background=True : 保存スレッド用。間隔を空けて3回まで再試行する（待ち時間には上限あり）
+    """
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {st.secrets['GITHUB_TOKEN']}",
+        "Accept": "application/vnd.github+json",
+    })
+    if background:
+        retry = _CappedRetry(
+            total=3, backoff_factor=1, backoff_max=8,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "PUT"}),
+            raise_on_status=False,
+        )
+    else:
+        retry = Retry(
+            total=1, backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+def _contents_url(file_path):
+    """Contents API のURL"""
+    return f"https://api.github.com/repos/{st.secrets['GITHUB_USERNAME']}/{st.secrets['GITHUB_REPO_NAME']}/contents/{file_path}"
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_portfolio(url):
+    """GitHub上のJSONを取得・デコードする（再接続やリロード時も60秒間は再取得しない）"""
+    res = _gh_session().get(url, timeout=GITHUB_TIMEOUT)
+    res.raise_for_status()
+    contents = res.json()
+    return load_json(base64.b64decode(contents["content"])), contents["sha"]
+
+def sync_github():
+    """
+    GitHubからポートフォリオを読み込む
+    （保存は sync_github_async でバックグラウンドに任せる）
+    読み込みに失敗した場合は None を返す（空のデータで保存してクラウド上のファイルを消さないため）
+    """
+    try:
+        url = _contents_url(st.secrets["DATA_FILE_PATH"])
     except Exception as e:
         st.error(f"GitHub接続エラー: {e}")
-        return {"portfolio": [], "settings": {}}
+        return None
     
-    if action == "load":
-        try:
-            contents = repo.get_contents(FILE_PATH)
-            decoded = base64.b64decode(contents.content).decode("utf-8")
-            loaded_data = json.loads(decoded)
-            if isinstance(loaded_data, list):
-                return {"portfolio": loaded_data, "settings": {"total_capital": 1000000, "risk_per_trade": 2.0}}
-            return loaded_data
-        except:
-            return {"portfolio": [], "settings": {"total_capital": 1000000, "risk_per_trade": 2.0}}
-            
-    if action == "save":
-        json_content = json.dumps(data, ensure_ascii=False, indent=4)
-        try:
-            contents = repo.get_contents(FILE_PATH)
-            repo.update_file(contents.path, f"Sync: {datetime.now()}", json_content, contents.sha)
-            st.toast("☁️ クラウド同期完了", icon="✅")
-        except:
-            repo.create_file(FILE_PATH, "Initial setup", json_content)
-            st.toast("☁️ 新規ファイル作成", icon="✅")
-    return data
+    try:
+        loaded_data, st.session_state.data_sha = _load_portfolio(url)
+    except requests.HTTPError as e:
+        # ファイルがまだ無い場合だけは空のポートフォリオから始める（初回保存で作成される）
+        if e.response is not None and e.response.status_code == 404:
+            return {"portfolio": {}, "settings": {"total_capital": 1000000, "risk_per_trade": 2.0}}
+        logger.warning("ポートフォリオの読み込みに失敗しました: %s", e)
+        st.error(f"ポートフォリオの読み込みに失敗しました: {e}")
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("ポートフォリオの読み込みに失敗しました: %s", e)
+        st.error(f"ポートフォリオの読み込みに失敗しました: {e}")
+        return None
+
+    st.session_state.saved_hash = hash(dump_json(loaded_data))
+    if isinstance(loaded_data, list):
+        loaded_data = {"portfolio": loaded_data, "settings": {"total_capital": 1000000, "risk_per_trade": 2.0}}
+    loaded_data["portfolio"] = index_portfolio(loaded_data.get("portfolio", []))
+    return loaded_data
+
+def write_github_file(session, url, json_content, sha=None):
+    """
+    JSONをリポジトリへ書き込み、通知用メッセージと新しいSHAを返す
+    （st.* を呼ばないのでスレッドから実行可能）
+    """
+    body = {
+        "message": f"Sync: {datetime.now()}",
+        "content": base64.b64encode(json_content.encode("utf-8")).decode("ascii"),
+    }
+    message = "☁️ クラウド同期完了"
+    res = None
+    if sha:
+        # 前回のSHAが最新なら事前の GET を省略して直接更新する
+        res = session.put(url, json={**body, "sha": sha}, timeout=GITHUB_TIMEOUT)
+    if res is None or not res.ok:
+        current = session.get(url, timeout=GITHUB_TIMEOUT)
+        if current.status_code == 404:
+            res = session.put(url, json={**body, "message": "Initial setup"}, timeout=GITHUB_TIMEOUT)
+            message = "☁️ 新規ファイル作成"
+        else:
+            current.raise_for_status()
+            res = session.put(url, json={**body, "sha": current.json()["sha"]}, timeout=GITHUB_TIMEOUT)
+    res.raise_for_status()
+
+    # 読み込みキャッシュを破棄し、次回の読み込みで保存後の内容を取得させる
+    _load_portfolio.clear()
+    return message, res.json()["content"]["sha"]
+
+@st.cache_resource
+def _save_executor():
+    """保存用のバックグラウンドスレッド（保存順序を守るため1本のみ）"""
+    return ThreadPoolExecutor(max_workers=1)
+
+def sync_github_async(data):
+    """GitHubへの保存をバックグラウンドで実行し、リランをブロックしない"""
+    # 以降の画面操作で data が書き換わっても影響しないよう、シリアライズはここで行う
+    json_content = dump_json(portfolio_payload(data))
+
+    # 前回の保存（または読み込み）から内容が変わっていなければアップロードしない
+    content_hash = hash(json_content)
+    if st.session_state.get("saved_hash") == content_hash: return
+    st.session_state.saved_hash = content_hash
+
+    # 書き込み待ちの保存があれば内容だけ差し替え、連続した保存を1回の書き込みにまとめる
+    # （まとめた側のセッションにも同じ future を登録し、失敗した場合に通知が届くようにする）
+    queue = _save_queue()
+    with queue["lock"]:
+        if queue["content"] is None:
+            queue["future"] = _save_executor().submit(_flush_saves, _gh_session(background=True), queue)
+        queue["content"] = (_contents_url(st.secrets["DATA_FILE_PATH"]), json_content)
+        if queue["sha"] is None:
+            queue["sha"] = st.session_state.get("data_sha")
+        future = queue["future"]
+    st.session_state.save_failed = False
+    pending = st.session_state.setdefault("pending_saves", [])
+    if future not in pending: pending.append(future)
+
+@st.cache_resource
+def _save_queue():
+    """書き込み待ちの最新内容とその書き込みの future、直前の書き込みで得たSHA"""
+    return {"lock": threading.Lock(), "content": None, "future": None, "sha": None}
+
+SAVE_DEBOUNCE_SEC = 0.5 # 連続した保存をまとめるための待ち時間（秒）
+
+def _flush_saves(session, queue):
+    """少し待ってから、その時点で最新の内容だけを書き込む（保存スレッドで実行）"""
+    time.sleep(SAVE_DEBOUNCE_SEC)
+    with queue["lock"]:
+        (url, json_content), sha = queue["content"], queue["sha"]
+        queue["content"] = None
+    message, new_sha = write_github_file(session, url, json_content, sha)
+    with queue["lock"]:
+        queue["sha"] = new_sha
+    return message, new_sha
+
+def mark_dirty():
+    """変更を記録してリランする（保存は main() の最後にまとめて行う）"""
+    st.session_state.dirty = True
+    st.rerun()
+
+def report_sync_status():
+    """完了したバックグラウンド保存の結果を通知する"""
+    pending = st.session_state.get("pending_saves", [])
+    for future in [f for f in pending if f.done()]:
+        pending.remove(future)
+        if future.exception() is not None:
+            # 失敗した内容を次回も保存できるよう、保存済みの記録を消す
+            st.session_state.pop("saved_hash", None)
+            st.session_state.save_failed = True
+            st.error(f"GitHub保存エラー: {future.exception()}")
+        else:
+            message, st.session_state.data_sha = future.result()
+            st.toast(message, icon="✅")
 
 @st.cache_data(ttl=3600)
 def fetch_stock_name(ticker):
     try:
+        # .info は quoteSummary 全体を取得するため、軽量な検索APIで銘柄名だけを引く
+        for quote in yf.Search(ticker, max_results=1, news_count=0).quotes:
+            if quote.get('symbol', '').upper() == ticker.upper():
+                return quote.get('shortname') or quote.get('longname') or ticker
         return yf.Ticker(ticker).info.get('shortName') or ticker
-    except:
+    except YF_ERRORS as e:
+        logger.warning("銘柄名の取得に失敗しました (%s): %s", ticker, e)
         return ticker
 
-@st.cache_data(ttl=3600)
-def get_technical_analysis(ticker):
+def get_stock_name(ticker):
+    """
+    銘柄名を取得する
+    一度取得した名前はポートフォリオJSONの "names" に保存され、次回以降は yfinance を呼ばない
+    """
+    names = st.session_state.data.setdefault("names", {})
+    if ticker not in names:
+        name = fetch_stock_name(ticker)
+        # 取得に失敗した場合（コードがそのまま返る）は保存しない
+        if name == ticker: return name
+        names[ticker] = name
+    return names[ticker]
+
+def fetch_all_histories(tickers):
+    """全銘柄の株価履歴を1回のリクエストでまとめて取得する"""
+    if not tickers: return {}
     try:
         # 長期判定(MA75など)のために期間を2年(2y)に延長
-        df = yf.Ticker(ticker).history(period="2y")
-        if df.empty: return None
-        
-        # logic.py で指標計算
-        df = logic.add_technical_indicators(df)
-        return df
-    except: return None
+        data = yf.download(list(tickers), period="2y", group_by='ticker', threads=True, progress=False, auto_adjust=False)
+    except YF_ERRORS as e:
+        logger.warning("株価履歴の取得に失敗しました: %s", e)
+        return {}
+    if data is None or data.empty: return {}
+
+    histories = {}
+    for t in tickers:
+        if t not in data.columns.get_level_values(0): continue
+        # 使用する列だけを残し、キャッシュやその後の計算を軽くする
+        df = data[t][['Close', 'High', 'Volume']].dropna()
+        if df.empty: continue
+        if df.index.tz is not None:
+            df.index = df.index.tz_localize(None)
+        # 出来高は float32 で十分な精度があるため縮める（株価は取得単価として保存されるため float64 のまま）
+        histories[t] = df.astype({'Volume': 'float32'})
+    return histories
+
+def _analyze_history(df):
+    """
+    1銘柄分の直近指標値を求める
+    履歴は購入日以降の高値を引くための PeriodHigh 列だけを残す
+    """
+    values = logic.get_latest_values(df)
+    return logic.add_period_high(df)[['PeriodHigh']], values
+
+@st.cache_data(ttl=3600)
+def get_technical_analysis(tickers):
+    """
+    全銘柄の株価を一括取得して指標を計算する
+    戻り値: ({ticker: PeriodHigh列のDataFrame}, {ticker: LatestValues})
+    numba 有効時は計算中に GIL が解放されるため、指標計算を並列に行う
+    （numba が無い場合は純 Python のループで GIL を握ったままなので、順番に計算する）
+    """
+    histories = fetch_all_histories(tickers)
+    if not histories: return {}, {}
+    # logic.py で指標計算
+    if logic.NUMBA_AVAILABLE and len(histories) > 1:
+        with ThreadPoolExecutor(max_workers=min(8, len(histories))) as ex:
+            results = dict(zip(histories, ex.map(_analyze_history, histories.values())))
+    else:
+        results = {t: _analyze_history(df) for t, df in histories.items()}
+    return {t: r[0] for t, r in results.items()}, {t: r[1] for t, r in results.items()}
 
 # ==========================================
-# 2. メインアプリケーション
+# 2. カードHTMLテンプレート
 # ==========================================
+_GENRE_TMPL = '<div class="card-genre">{}</div>'
+_GENRE_SPACER = '<div style="height: 20px;"></div>' # レイアウト崩れ防止のスペーサー
+
+_EXIT_CARD_TMPL = """
+<div class="guide-card {card_class}">
+    <div class="card-header">
+        <span class="card-ticker">{ticker}</span>
+        <span class="{label_class}">{label}</span>
+    </div>
+    <div class="card-name">{name}</div>
+    {genre_html}
+    <div class="card-price-area">
+        {order_price:,.0f} <span class="card-price-unit">円以下で売</span>
+    </div>
+    <div class="card-footer">
+        <div>建値：{price:,.0f}</div>
+        <div>現在：{curr:,.0f}</div>
+        <div style="color:{pl_color}; font-weight:bold;">
+            損益: {unrealized_pl:+,.0f} 円 ({profit_pct:+.1f}%)
+        </div>
+        <div>期間高値：{high:,.0f} 円</div>
+        <div>保有株数：{shares} 株</div>
+    </div>
+</div>
+"""
+
+_ENTRY_CARD_TMPL = """
+<div class="guide-card {card_class}">
+    <div class="card-header">
+        <span class="card-ticker">{ticker}</span>
+        <span class="{label_class}">{label}</span>
+    </div>
+    <div class="card-name">{name}</div>
+    {genre_html}
+    <div class="card-price-area">
+        {curr:,.0f} <span class="card-price-unit">円</span>
+    </div>
+    <div class="card-footer">
+        <div>RSI：{rsi:.1f}</div>
+        <div>出来高倍率：{vol_ratio:.1f}倍</div>
+        <div>期間高値：{high:,.0f} 円</div>
+        <div style="font-size: 0.7rem; color: #aaa; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;">
+            要因：{reasons}
+        </div>
+    </div>
+</div>
+"""
+
+def grid_html(cards):
+    """カードHTMLを1つのグリッドにまとめる（最大3列、st.markdown 1回で描画できる）"""
+    return f'<div class="guide-grid" style="--grid-cols: {max(1, min(len(cards), 3))}">{"".join(cards)}</div>'
+
+CARD_LIMIT = 9 # 1タブに並べるカードの上限（3列 x 3行）
+
+def top_cards(items, key, priority):
+    """
+    カードが上限を超える場合は重要度の高い順に並べ、上位 CARD_LIMIT 件だけを返す
+    （「すべて表示」をオンにすると全件を重要度順で返す）
+    """
+    if len(items) <= CARD_LIMIT: return items
+    items = sorted(items, key=priority, reverse=True)
+    if st.toggle(f"すべて表示（全{len(items)}件）", key=key): return items
+    st.caption(f"重要度の高い上位{CARD_LIMIT}件を表示しています")
+    return items[:CARD_LIMIT]
+
+def genre_html(stock):
+    """ジャンルがあれば表示し、無ければ高さを揃えるスペーサーを返す"""
+    return _GENRE_TMPL.format(stock['genre']) if stock.get('genre') else _GENRE_SPACER
+
+# ==========================================
+# 3. メインアプリケーション
+# ==========================================
+def reset_portfolio_editor():
+    """
+    エディタのキーを切り替えて編集状態を破棄する
+    反映済みの編集（差分）が新しいデータへ二重に適用されるのを防ぐ
+    """
+    st.session_state.editor_version = st.session_state.get("editor_version", 0) + 1
+
+@st.fragment
+def render_portfolio_editor(settings, latest, default_stop_pct):
+    """
+    ポートフォリオ一括管理（JSON編集）
+    フラグメントにして、セル編集や「選択」のチェックではこの部分だけを再実行する
+    （データを書き換えるボタンは st.rerun() でアプリ全体を再実行する）
+    """
+    with st.expander("🛠️ ポートフォリオ一括管理 (JSON編集)", expanded=False):
+        # list[dict] をそのまま渡し、DataFrame への往復変換を省く
+        # 削除・保有への移行は行ごとのボタンではなく「選択」列のチェックでまとめて行う
+        edited = st.data_editor(
+            [{"_action": False, **p} for p in st.session_state.data["portfolio"].values()],
+            key=f"portfolio_editor_{st.session_state.get('editor_version', 0)}",
+            num_rows="dynamic",
+            use_container_width=True,
+            # カラム順序を整理（見やすくするため）
+            column_order=['_action', 'ticker', 'name', 'genre', 'status', 'price', 'shares', 'custom_stop', 'custom_trail', 'id'],
+            column_config={
+                "_action": st.column_config.CheckboxColumn("選択"),
+                "genre": st.column_config.TextColumn(),
+                "shares": st.column_config.NumberColumn(),
+                "custom_stop": st.column_config.NumberColumn(),
+                "custom_trail": st.column_config.NumberColumn(),
+            },
+        )
+        selected = [bool(r.get("_action")) for r in edited]
+        # 空のセルは NaN で返るため、JSON往復をせずにその場で None に戻す
+        rows = [{k: (None if pd.isna(v) else v) for k, v in r.items() if k != "_action"} for r in edited]
+
+        # 選択された行の id（移行・削除は該当銘柄だけを id で直接更新する）
+        selected_ids = [r.get("id") for r, is_selected in zip(rows, selected) if is_selected]
+        portfolio = st.session_state.data["portfolio"]
+        # 保有への移行は監視銘柄のみ（保有中の銘柄の取得単価・株数を上書きしない）
+        watching_ids = [sid for sid in selected_ids if portfolio.get(sid, {}).get('status') == 'watching']
+
+        col_save, col_move, col_del = st.columns(3)
+        if col_save.button("変更をクラウド保存", use_container_width=True):
+            # 編集が無ければ保存もリランもしない（前回の保存に失敗していれば再保存する）
+            if rows_changed(rows, portfolio) or st.session_state.get("save_failed"):
+                st.session_state.data["portfolio"] = index_portfolio(rows, stamp_new=True)
+                sync_github_async(st.session_state.data)
+                reset_portfolio_editor()
+                st.rerun()
+            st.toast("変更はありません", icon="ℹ️")
+        if col_move.button("選択した銘柄を保有へ", use_container_width=True, disabled=not watching_ids):
+            for sid in watching_ids:
+                p = portfolio[sid]
+                m = latest.get(p['ticker'])
+                if m is None: continue
+                p['status'] = 'holding'
+                p['price'] = m.close
+                p['shares'] = logic.calculate_position_size(
+                    settings.get("total_capital", 1000000),
+                    settings.get("risk_per_trade", 2.0),
+                    m.close,
+                    default_stop_pct
+                )
+            reset_portfolio_editor()
+            mark_dirty()
+        if col_del.button("選択した銘柄を削除", use_container_width=True, disabled=not selected_ids):
+            for sid in selected_ids:
+                portfolio.pop(sid, None)
+            reset_portfolio_editor()
+            mark_dirty()
+
 def main():
     if not check_password(): return
     load_css("style.css")
+    report_sync_status()
     
     if 'data' not in st.session_state:
-        st.session_state.data = sync_github(action="load")
+        loaded = sync_github()
+        if loaded is None:
+            # 読み込めないまま操作を続けると、次の保存でクラウド上のデータを空で上書きしてしまうため止める
+            if st.button("🔄 再読み込み"): st.rerun()
+            st.stop()
+        st.session_state.data = loaded
     
     data = st.session_state.data
     settings = data.get("settings", {"total_capital": 1000000, "risk_per_trade": 2.0})
 
+    # 株価履歴と直近の指標値は全銘柄分をまとめて取得する（1時間キャッシュ）
+    histories, latest = get_technical_analysis(tuple(sorted({p['ticker'] for p in data['portfolio'].values()})))
+    tech = histories.get
+
     st.title("📈 Trend Checker Pro v6.1")
 
     # --- サイドバー ---
@@ -127,6 +565,11 @@ def main():
         # ロジックに渡す用の文字列変換
         strategy_mode = "short" if "Short" in strategy_mode_jp else "long"
 
+        # 株価は1時間キャッシュするため、すぐに最新値を見たいときは手動で破棄する
+        if st.button("🔄 株価を再取得", use_container_width=True):
+            get_technical_analysis.clear()
+            st.rerun()
+
         st.divider()
         st.header("💰 資金管理設定")
         new_capital = st.number_input("総投資資金 (円)", value=int(settings.get("total_capital", 1000000)), step=100000)
@@ -134,7 +577,7 @@ def main():
         
         if st.button("資金設定を保存", use_container_width=True):
             st.session_state.data["settings"] = {"total_capital": new_capital, "risk_per_trade": new_risk}
-            sync_github(st.session_state.data, action="save")
+            sync_github_async(st.session_state.data)
             st.rerun()
             
         st.divider()
@@ -153,9 +596,11 @@ def main():
             t_shares = st.number_input("株数", min_value=0, step=100, value=100)
             if st.form_submit_button("銘柄を追加"):
                 if t_code:
-                    name = fetch_stock_name(t_code)
-                    st.session_state.data["portfolio"].append({
-                        "id": str(datetime.now().timestamp()),
+                    name = get_stock_name(t_code)
+                    new_id = uuid.uuid4().hex
+                    st.session_state.data["portfolio"][new_id] = {
+                        "id": new_id,
+                        "created_at": str(time.time()), # 購入日以降の高値判定に使う登録日時
                         "ticker": t_code, 
                         "name": name, 
                         "genre": t_genre, # --- 追加 ---
@@ -163,8 +608,8 @@ def main():
                         "shares": t_shares, 
                         "status": "holding" if "保有" in t_status else "watching",
                         "custom_stop": None, "custom_trail": None
-                    })
-                    sync_github(st.session_state.data, action="save")
+                    }
+                    sync_github_async(st.session_state.data)
                     st.rerun()
 
         st.divider()
@@ -172,41 +617,33 @@ def main():
         uploaded_file = st.file_uploader("JSONファイルをアップロード", type=["json"])
         if uploaded_file is not None:
             try:
-                import_data = json.load(uploaded_file)
+                import_data = load_json(uploaded_file.getvalue())
                 if isinstance(import_data, list):
-                    st.session_state.data["portfolio"] = import_data
+                    st.session_state.data["portfolio"] = index_portfolio(import_data)
                 elif isinstance(import_data, dict) and "portfolio" in import_data:
-                    st.session_state.data["portfolio"] = import_data["portfolio"]
+                    st.session_state.data["portfolio"] = index_portfolio(import_data["portfolio"])
                     if "settings" in import_data:
                         st.session_state.data["settings"] = import_data["settings"]
-                sync_github(st.session_state.data, action="save")
+                sync_github_async(st.session_state.data)
                 st.rerun()
             except Exception as e:
                 st.error(f"読み込みエラー: {e}")
 
     # --- データエディタ ---
-    with st.expander("🛠️ ポートフォリオ一括管理 (JSON編集)", expanded=False):
-        df_editor = pd.DataFrame(st.session_state.data["portfolio"])
-        # genre カラムなども編集可能にする
-        for col in ['genre', 'shares', 'custom_stop', 'custom_trail']: # --- 'genre' を追加 ---
-            if col not in df_editor.columns: df_editor[col] = None
-        
-        # カラム順序を整理（見やすくするため）
-        cols_order = [c for c in ['ticker', 'name', 'genre', 'status', 'price', 'shares', 'custom_stop', 'custom_trail', 'id'] if c in df_editor.columns]
-        df_editor = df_editor[cols_order]
-
-        edited_df = st.data_editor(df_editor, num_rows="dynamic", use_container_width=True)
-        if st.button("変更をクラウド保存", use_container_width=True):
-            st.session_state.data["portfolio"] = edited_df.to_dict(orient="records")
-            sync_github(st.session_state.data, action="save")
-            st.rerun()
+    render_portfolio_editor(settings, latest, default_stop_pct)
 
     # --- メインタブ ---
     tab1, tab2 = st.tabs(["🚀 保有銘柄 (Exit)", "🔍 監視銘柄 (Entry)"])
 
+    # 保有銘柄と監視銘柄を1回の走査で振り分ける
+    current_holdings, current_watchings = [], []
+    for s in st.session_state.data["portfolio"].values():
+        status = s.get("status")
+        if status == "holding": current_holdings.append(s)
+        elif status == "watching": current_watchings.append(s)
+
     # --- タブ1: 保有銘柄 ---
     with tab1:
-        current_holdings = [s for s in st.session_state.data["portfolio"] if s.get("status") == "holding"]
         total_market_value = 0
         
         if not current_holdings:
@@ -215,15 +652,15 @@ def main():
             st.markdown(f"### 📋 逆指値注文")
             st.caption("証券アプリで以下の逆指値（成行売）を設定してください。")
             
-            # 3列グリッドで表示
-            cols = st.columns(len(current_holdings) if len(current_holdings) < 3 else 3)
-            
-            for idx, s in enumerate(current_holdings):
-                df = get_technical_analysis(s['ticker'])
+            # 3列グリッドで表示（全カードをまとめて1回で描画）
+            entries = []
+            for s in current_holdings:
+                df = tech(s['ticker'])
                 if df is None: continue
                 
-                # 指標取得
-                curr, high, rsi, ma75 = logic.get_latest_metrics(df, s['price'], s['id'])
+                # 指標取得（登録日時が無い旧データは全期間の高値で判定する）
+                created_at = s.get('created_at')
+                curr, high, rsi, ma75 = logic.get_latest_metrics(df, s['price'], created_at, latest[s['ticker']])
                 
                 p_stop = s.get('custom_stop')
                 p_trail = s.get('custom_trail')
@@ -242,62 +679,30 @@ def main():
                 unrealized_pl = (curr - s['price']) * s.get('shares', 0)
                 pl_color = "#2ecc71" if unrealized_pl > 0 else "#ff4b4b" # 修正：プラスなら緑
                 
-                # ジャンル取得
-                genre_text = s.get('genre') if s.get('genre') else ""
-
-                with cols[idx % 3]:
-                    # カードHTMLの構築
-                    html = f"""
-                    <div class="guide-card {card_class}">
-                        <div class="card-header">
-                            <span class="card-ticker">{s['ticker']}</span>
-                            <span class="{label_class}">{strategy['label']}</span>
-                        </div>
-                        <div class="card-name">{s.get('name', s['ticker'])}</div>
-                    """
-                    
-                    # ジャンルがあれば表示
-                    if genre_text:
-                        html += f'<div class="card-genre">{genre_text}</div>'
-                    else:
-                        html += '<div style="height: 20px;"></div>' # レイアウト崩れ防止のスペーサー
-
-                    html += f"""
-                        <div class="card-price-area">
-                            {strategy['order_price']:,.0f} <span class="card-price-unit">円以下で売</span>
-                        </div>
-                        <div class="card-footer">
-                            <div>建値：{s['price']:,.0f}</div>
-                            <div>現在：{curr:,.0f}</div>
-                            <div style="color:{pl_color}; font-weight:bold;">
-                                損益: {unrealized_pl:+,.0f} 円 ({strategy['profit_pct']:+.1f}%)
-                            </div>
-                            <div>期間高値：{high:,.0f} 円</div>
-                            <div>保有株数：{s.get('shares', 0)} 株</div>
-                        </div>
-                    </div>
-                    """
-                    st.markdown(html, unsafe_allow_html=True)
-                    
-                    # 削除ボタン
-                    if  st.button("削除", key=f"del_{s['id']}", use_container_width=True, type="primary"):
-                        st.session_state.data["portfolio"] = [x for x in st.session_state.data["portfolio"] if x['id'] != s['id']]
-                        sync_github(st.session_state.data, action="save")
-                        st.rerun()
+                # カードHTMLの値（重要度：緊急脱出 > 損益率の大きさ）
+                entries.append(((strategy['is_emergency'], abs(strategy['profit_pct'])), {
+                    "card_class": card_class, "label_class": label_class,
+                    "ticker": s['ticker'], "label": strategy['label'],
+                    "name": s.get('name', s['ticker']), "genre_html": genre_html(s),
+                    "order_price": strategy['order_price'], "price": s['price'], "curr": curr,
+                    "pl_color": pl_color, "unrealized_pl": unrealized_pl, "profit_pct": strategy['profit_pct'],
+                    "high": high, "shares": s.get('shares', 0),
+                }))
             
                 total_market_value += (curr * s.get('shares', 0))
 
+            shown = top_cards(entries, "show_all_holdings", priority=lambda e: e[0])
+            cards = [_EXIT_CARD_TMPL.format_map(fields).strip() for _, fields in shown]
+            st.markdown(grid_html(cards), unsafe_allow_html=True)
+
     # --- タブ2: 監視銘柄 ---
     with tab2:
-        current_watchings = [s for s in st.session_state.data["portfolio"] if s.get("status") == "watching"]
-        
         # 現金余力計算
         current_holdings_value = 0
-        for h in st.session_state.data["portfolio"]:
-             if h.get("status") == "holding":
-                 df_temp = get_technical_analysis(h['ticker'])
-                 if df_temp is not None:
-                     current_holdings_value += df_temp['Close'].iloc[-1] * h.get('shares', 0)
+        for h in current_holdings:
+            m = latest.get(h['ticker'])
+            if m is None: continue
+            current_holdings_value += m.close * h.get('shares', 0)
                      
         cash_pos = settings.get("total_capital", 1000000) - current_holdings_value
         
@@ -307,74 +712,39 @@ def main():
         if not current_watchings:
             st.info("監視中の銘柄はありません。サイドバーから追加してください。")
         else:
-            cols = st.columns(len(current_watchings) if len(current_watchings) < 3 else 3)
+            # 株価を取得できた銘柄のスコアをまとめて計算し、描画ループでは結果を並べるだけにする
+            watch_targets = [s for s in current_watchings if s['ticker'] in latest]
+            scores, reasons_list = logic.score_entry_strategies([latest[s['ticker']] for s in watch_targets])
 
-            for idx, s in enumerate(current_watchings):
-                df = get_technical_analysis(s['ticker'])
-                if df is None: continue
-                
-                curr = df['Close'].iloc[-1]
-                rsi = df['RSI'].iloc[-1]
-                vol_curr = df['Volume'].iloc[-1]
-                vol_ma5 = df['VolMA5'].iloc[-1]
+            # 件数が多い場合はスコアの高い銘柄だけをカードにする
+            shown = top_cards(list(zip(watch_targets, scores, reasons_list)), "show_all_watchings", priority=lambda e: e[1])
+
+            cards = []
+            for s, score, reasons in shown:
+                m = latest[s['ticker']]
+                curr, rsi, vol_curr, vol_ma5 = m.close, m.rsi, m.vol, m.vol_ma5
                 vol_ratio = vol_curr / vol_ma5 if vol_ma5 > 0 else 0
                 
-                score, reasons = logic.analyze_entry_strategy(df)
-                
-                rec_shares = logic.calculate_position_size(
-                    settings.get("total_capital", 1000000), 
-                    settings.get("risk_per_trade", 2.0), 
-                    curr, 
-                    default_stop_pct
-                )
-                
                 is_buy_signal = score >= 50
                 card_class = "bg-safe" if is_buy_signal else "bg-normal"
                 label_text = f"🚀 買い時：{score}点" if is_buy_signal else f"💤 監視中：{score}点"
                 label_class = "card-label-green" if is_buy_signal else "card-label-gray"
                 
-                reason_text = ", ".join(reasons) if reasons else "特になし"
-                genre_text = s.get('genre') if s.get('genre') else ""
-
-                with cols[idx % 3]:
-                    html = f"""
-                    <div class="guide-card {card_class}">
-                        <div class="card-header">
-                            <span class="card-ticker">{s['ticker']}</span>
-                            <span class="{label_class}">{label_text}</span>
-                        </div>
-                        <div class="card-name">{s.get('name', s['ticker'])}</div>
-                    """
-
-                    if genre_text:
-                        html += f'<div class="card-genre">{genre_text}</div>'
-                    else:
-                        html += '<div style="height: 20px;"></div>'
-
-                    html += f"""
-                        <div class="card-price-area">
-                            {curr:,.0f} <span class="card-price-unit">円</span>
-                        </div>
-                        <div class="card-footer">
-                            <div>RSI：{rsi:.1f}</div>
-                            <div>出来高倍率：{vol_ratio:.1f}倍</div>
-                            <div>期間高値：{high:,.0f} 円</div>
-                            <div style="font-size: 0.7rem; color: #aaa; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;">
-                                要因：{reason_text}
-                            </div>
-                        </div>
-                    </div>
-                    """
-                    st.markdown(html, unsafe_allow_html=True)
-
-                    if st.button("保有へ", key=f"mov_{s['id']}", use_container_width=True, type="primary"):
-                        for p in st.session_state.data["portfolio"]:
-                            if p['id'] == s['id']:
-                                p['status'] = 'holding'
-                                p['price'] = curr
-                                p['shares'] = rec_shares
-                        sync_github(st.session_state.data, action="save")
-                        st.rerun()
+                cards.append(_ENTRY_CARD_TMPL.format_map({
+                    "card_class": card_class, "label_class": label_class,
+                    "ticker": s['ticker'], "label": label_text,
+                    "name": s.get('name', s['ticker']), "genre_html": genre_html(s),
+                    "curr": curr, "rsi": rsi, "vol_ratio": vol_ratio,
+                    "high": m.high,
+                    "reasons": ", ".join(reasons) if reasons else "特になし",
+                }).strip())
+
+            st.markdown(grid_html(cards), unsafe_allow_html=True)
+
+    # 一括管理での削除・移行による変更は描画後にまとめて1回だけ保存する
+    if st.session_state.get("dirty"):
+        st.session_state.dirty = False
+        sync_github_async(st.session_state.data)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file